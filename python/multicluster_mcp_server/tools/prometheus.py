@@ -1,12 +1,13 @@
 from typing import Annotated, Optional
 from pydantic import Field
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from dateutil.parser import parse as parse_datetime
 import pandas
 
 from multicluster_mcp_server.tools.connect import setup_cluster_access, get_kubeconfig_file
 from multicluster_mcp_server.tools.kubectl import validate_kubeconfig_file
 from multicluster_mcp_server.utils.prom_connect import prom_connect
+from multicluster_mcp_server.utils.promql_planner import pushdown_aggregation, plan_range_step, QueryBudgetExceeded
 from multicluster_mcp_server.core.mcp_instance import mcp
 from prometheus_api_client import PrometheusConnect, MetricSnapshotDataFrame, MetricRangeDataFrame
 
@@ -27,7 +28,7 @@ def prometheus(
     ] = None,
     step: Annotated[
         Optional[str],
-        Field(description="(Only for data_type='range') Query resolution step (e.g., '30s', '5m', '1h').")
+        Field(description="(Only for data_type='range') Query resolution step (e.g., '30s', '5m', '1h'). Raised automatically if series x points exceeds PROMETHEUS_MAX_SAMPLES.")
     ] = "5m",
 ) -> Annotated[dict, Field(description="Formatted result including Recharts-compatible data or error message.")]:
     try:
@@ -63,24 +64,53 @@ def prometheus(
         pc = prom_connect(kubeconfig=kubeconfig_file)
         effective_unit = infer_unit(unit, ql)
 
+        # Plan the query: only the group_by label reaches the output, so aggregate on the server
+        planned_ql, decision = pushdown_aggregation(ql, group_by)
+        plan = {"query": planned_ql, "decisions": [decision]}
+
         # Query data
         if data_type == "range":
-            end_dt = parse_datetime(end) 
-            start_dt = parse_datetime(start) 
+            end_dt = parse_datetime(end) if end else datetime.now(timezone.utc)
+            start_dt = parse_datetime(start)
+            # Times without an offset are taken as UTC, so naive and aware inputs can be compared
+            if end_dt.tzinfo is None:
+                end_dt = end_dt.replace(tzinfo=timezone.utc)
+            if start_dt.tzinfo is None:
+                start_dt = start_dt.replace(tzinfo=timezone.utc)
+
+            # Estimate the series count with a cheap instant probe before pulling the full range.
+            # Scalar queries cannot be counted, so a failed probe leaves the user's step unchecked.
+            try:
+                probe = pc.custom_query(query=f"count(\n{planned_ql}\n)", params={"time": end_dt.timestamp()})
+                series = int(float(probe[0]["value"][1])) if probe else 0
+            except Exception as e:
+                series = None
+                plan["decisions"].append(f"series estimate unavailable, running with step {step}: {e}")
+
+            if series is not None:
+                try:
+                    step, decision = plan_range_step(series, start_dt, end_dt, step)
+                except QueryBudgetExceeded as e:
+                    plan["decisions"].append(str(e))
+                    return {"not get the data": str(e), "plan": plan}
+                plan["decisions"].append(decision)
+            plan["step"] = step
+
             result = pc.custom_query_range(
-                query=ql,
+                query=planned_ql,
                 start_time=start_dt,
                 end_time=end_dt,
                 step=step
             )
         else:
-            result = pc.custom_query(query=ql)
+            result = pc.custom_query(query=planned_ql)
             
         if len(result) == 0:
             return {
               "data": [],
                 "type": data_type,
-                "unit": effective_unit
+                "unit": effective_unit,
+                "plan": plan
             }
 
         # Format result
@@ -120,13 +150,15 @@ def prometheus(
         print({
             "data": recharts_data,
             "type": data_type,
-            "unit": effective_unit
+            "unit": effective_unit,
+            "plan": plan
         })
         
         return {
             "data": recharts_data,
             "type": data_type,
-            "unit": effective_unit
+            "unit": effective_unit,
+            "plan": plan
         }
 
     except Exception as e:
@@ -0,0 +1,196 @@
+import math
+import os
+import re
+from datetime import datetime
+from typing import Optional, Tuple
+
+# Upper bound on series x points a single range query may return, and what to do when a query exceeds it:
+# 'step' widens the resolution step to fit the budget, 'reject' refuses to run the query.
+DEFAULT_MAX_SAMPLES = 20000
+DEFAULT_BUDGET_ACTION = "step"
+
+AGGREGATIONS = {
+    "sum", "avg", "min", "max", "count", "group", "stddev", "stdvar",
+    "topk", "bottomk", "quantile", "count_values", "limitk", "limit_ratio",
+}
+
+# Single-argument functions that keep the input labels, so summing their output by a label is still meaningful.
+# The range functions take a range vector ('foo[5m]') and return an instant vector; the others map instant to instant.
+RANGE_FUNCTIONS = {
+    "rate", "irate", "increase", "delta", "idelta", "deriv", "resets", "changes",
+    "avg_over_time", "min_over_time", "max_over_time", "sum_over_time",
+    "count_over_time", "last_over_time", "stddev_over_time", "stdvar_over_time",
+}
+INSTANT_FUNCTIONS = {"abs", "ceil", "floor", "round", "exp", "sqrt", "ln", "log2", "log10"}
+
+NICE_STEPS = [
+    15, 30, 60, 120, 300, 600, 900, 1800,
+    3600, 7200, 10800, 21600, 43200, 86400, 172800, 604800,
+]
+
+DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800, "y": 31536000}
+
+LABEL_NAME = re.compile(r"^[a-zA-Z_][a-zA-Z0-9_]*$")
+DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h|d|w|y)")
+BINARY_OPERATOR = re.compile(r"[-+*/%^<>=!]|\b(?:and|or|unless)\b")
+SELECTOR = re.compile(
+    r"^\s*(?:[a-zA-Z_:][a-zA-Z0-9_:]*\s*(?:\{\})?|\{\})\s*(\[\])?"
+    r"(?:\s*offset\s+\S+)?(?:\s*@\s*\S+)?\s*$"
+)
+FUNCTION_CALL = re.compile(r"^\s*([a-zA-Z_][a-zA-Z0-9_]*)\s*\(\)\s*$")
+AGGREGATION_CALL = re.compile(r"^\s*([a-zA-Z_]+)\s*(?:(?:by|without)\s*\(\)\s*)?\(\)(?:\s*(?:by|without)\s*\(\))?\s*$")
+
+
+class QueryBudgetExceeded(ValueError):
+    """Raised when a range query is over the sample budget and cannot be stepped down to fit."""
+
+
+def _top_level(ql: str) -> str:
+    """Return the query text outside any brackets, with string literals and comments dropped."""
+    out = []
+    depth = 0
+    quote = None
+    escaped = False
+    comment = False
+    for ch in ql:
+        if comment:
+            comment = ch != "\n"
+            continue
+        if quote:
+            if escaped:
+                escaped = False
+            elif ch == "\\" and quote != "`":
+                escaped = True
+            elif ch == quote:
+                quote = None
+            continue
+        if ch in "\"'`":
+            quote = ch
+        elif ch == "#":
+            comment = True
+        elif ch in "([{":
+            if depth == 0:
+                out.append(ch)
+            depth += 1
+        elif ch in ")]}":
+            depth -= 1
+            if depth == 0:
+                out.append(ch)
+        elif depth == 0:
+            out.append(ch)
+    return "".join(out)
+
+
+def _inner(ql: str) -> str:
+    """Return the text between the outermost parentheses of a function call."""
+    return ql[ql.index("(") + 1:ql.rindex(")")]
+
+
+def _is_pushdown_safe(ql: str, range_allowed: bool = False) -> Tuple[bool, str]:
+    top = _top_level(ql)
+    if BINARY_OPERATOR.search(top):
+        return False, "query is a binary expression"
+
+    match = AGGREGATION_CALL.match(top)
+    if match and match.group(1) in AGGREGATIONS:
+        return False, f"query is already aggregated with '{match.group(1)}'"
+
+    match = FUNCTION_CALL.match(top)
+    if match:
+        name = match.group(1)
+        if name not in RANGE_FUNCTIONS and name not in INSTANT_FUNCTIONS:
+            return False, f"function '{name}' does not preserve series labels"
+        inner = _inner(ql)
+        if "," in _top_level(inner):
+            return False, f"function '{name}' takes more than one argument"
+        return _is_pushdown_safe(inner, range_allowed=name in RANGE_FUNCTIONS)
+
+    match = SELECTOR.match(top)
+    if match:
+        if match.group(1) and not range_allowed:
+            return False, "query is a range vector"
+        return True, ""
+    return False, "query is not a plain series selector"
+
+
+def pushdown_aggregation(ql: str, group_by: str) -> Tuple[str, str]:
+    """Wrap a non-aggregated query in 'sum by (<group_by>)' so the server drops the labels the output never uses."""
+    if not LABEL_NAME.match(group_by or ""):
+        return ql, f"aggregation pushdown skipped: '{group_by}' is not a valid label name"
+
+    safe, reason = _is_pushdown_safe(ql)
+    if not safe:
+        return ql, f"aggregation pushdown skipped: {reason}"
+
+    # Close the wrapper on its own line so a trailing '#' comment in the query cannot swallow the paren
+    planned = f"sum by ({group_by}) (\n{ql.strip()}\n)"
+    return planned, f"aggregation pushed down: wrapped query in 'sum by ({group_by})'"
+
+
+def parse_duration(duration: str) -> float:
+    """Parse a Prometheus duration ('30s', '1h30m') or a float number of seconds into seconds."""
+    text = str(duration).strip()
+    try:
+        seconds = float(text)
+    except ValueError:
+        parts = DURATION_PART.findall(text)
+        if not parts or "".join(n + u for n, u in parts) != text:
+            raise ValueError(f"Invalid step duration: '{duration}'.")
+        seconds = sum(float(n) * DURATION_UNITS[u] for n, u in parts)
+    if seconds <= 0:
+        raise ValueError(f"Step duration must be positive: '{duration}'.")
+    return seconds
+
+
+def format_duration(seconds: float) -> str:
+    remaining = int(math.ceil(seconds))
+    parts = []
+    for unit in ("w", "d", "h", "m", "s"):
+        size = DURATION_UNITS[unit]
+        if remaining >= size:
+            parts.append(f"{remaining // size}{unit}")
+            remaining %= size
+    return "".join(parts) or "1s"
+
+
+def count_points(start: datetime, end: datetime, step_seconds: float) -> int:
+    span = (end - start).total_seconds()
+    if span < 0:
+        raise ValueError("Range query 'start' must not be after 'end'.")
+    return int(span // step_seconds) + 1
+
+
+def max_samples() -> int:
+    return int(os.getenv("PROMETHEUS_MAX_SAMPLES", DEFAULT_MAX_SAMPLES))
+
+
+def budget_action() -> str:
+    action = os.getenv("PROMETHEUS_BUDGET_ACTION", DEFAULT_BUDGET_ACTION).lower()
+    if action not in ("step", "reject"):
+        raise ValueError(f"Invalid PROMETHEUS_BUDGET_ACTION '{action}'. Must be 'step' or 'reject'.")
+    return action
+
+
+def plan_range_step(
+    series: int, start: datetime, end: datetime, step: str,
+    budget: Optional[int] = None, action: Optional[str] = None,
+) -> Tuple[str, str]:
+    """Check series x points against the budget, returning the step to use and the decision taken."""
+    budget = max_samples() if budget is None else budget
+    action = budget_action() if action is None else action
+
+    points = count_points(start, end, parse_duration(step))
+    samples = series * points
+    if samples <= budget:
+        return step, f"estimated {series} series x {points} points = {samples} samples, within budget of {budget}"
+
+    over = f"estimated {series} series x {points} points = {samples} samples exceeds budget of {budget}"
+    max_points = budget // series if series else 0
+    if action == "reject" or max_points < 2:
+        raise QueryBudgetExceeded(f"Query rejected: {over}. Narrow the selector, shorten the range, or increase the step.")
+
+    required = (end - start).total_seconds() / (max_points - 1)
+    new_seconds = next((s for s in NICE_STEPS if s >= required), math.ceil(required))
+    new_step = format_duration(new_seconds)
+    new_points = count_points(start, end, new_seconds)
+    return new_step, f"{over}; step raised from {step} to {new_step} ({series} series x {new_points} points)"
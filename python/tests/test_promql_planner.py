@@ -0,0 +1,99 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from multicluster_mcp_server.utils.promql_planner import (
+    QueryBudgetExceeded,
+    parse_duration,
+    plan_range_step,
+    pushdown_aggregation,
+)
+
+START = datetime(2025, 6, 5, tzinfo=timezone.utc)
+END = datetime(2025, 6, 7, tzinfo=timezone.utc)
+
+
+def test_pushdown_wraps_plain_selector():
+    ql, decision = pushdown_aggregation('container_memory_usage_bytes{container!=""}', "pod")
+    assert ql == 'sum by (pod) (\ncontainer_memory_usage_bytes{container!=""}\n)'
+    assert decision.startswith("aggregation pushed down")
+
+
+def test_pushdown_wraps_range_function():
+    ql, _ = pushdown_aggregation("rate(container_cpu_usage_seconds_total[5m])", "namespace")
+    assert ql.startswith("sum by (namespace) (")
+
+
+def test_pushdown_skips_top_level_range_selector():
+    ql, decision = pushdown_aggregation("foo[5m]", "pod")
+    assert ql == "foo[5m]"
+    assert "range vector" in decision
+
+
+def test_pushdown_keeps_trailing_comment_inside_query():
+    ql, _ = pushdown_aggregation("foo # memory", "pod")
+    assert ql == "sum by (pod) (\nfoo # memory\n)"
+
+
+def test_pushdown_skips_existing_aggregation():
+    ql, decision = pushdown_aggregation("sum(foo) by (pod)", "pod")
+    assert ql == "sum(foo) by (pod)"
+    assert "already aggregated" in decision
+
+
+def test_pushdown_skips_binary_expression():
+    ql, decision = pushdown_aggregation("foo / bar", "pod")
+    assert ql == "foo / bar"
+    assert "binary expression" in decision
+
+
+def test_pushdown_skips_multi_argument_function():
+    ql, decision = pushdown_aggregation("quantile_over_time(0.9, foo[5m])", "pod")
+    assert ql == "quantile_over_time(0.9, foo[5m])"
+    assert "skipped" in decision
+
+
+def test_pushdown_skips_scalar():
+    ql, decision = pushdown_aggregation("time()", "pod")
+    assert ql == "time()"
+    assert "skipped" in decision
+
+
+@pytest.mark.parametrize("duration, seconds", [("30s", 30), ("5m", 300), ("1h30m", 5400), ("90", 90)])
+def test_parse_duration(duration, seconds):
+    assert parse_duration(duration) == seconds
+
+
+@pytest.mark.parametrize("duration", ["5x", "1h foo", "0s", "None"])
+def test_parse_duration_invalid(duration):
+    with pytest.raises(ValueError):
+        parse_duration(duration)
+
+
+def test_plan_range_step_within_budget():
+    step, decision = plan_range_step(10, START, END, "5m", budget=20000, action="step")
+    assert step == "5m"
+    assert "within budget" in decision
+
+
+def test_plan_range_step_raises_step():
+    step, decision = plan_range_step(500, START, END, "1m", budget=20000, action="step")
+    assert step == "2h"
+    assert parse_duration(step) > 60
+    assert "step raised from 1m to 2h" in decision
+
+
+def test_plan_range_step_rejects():
+    with pytest.raises(QueryBudgetExceeded):
+        plan_range_step(500, START, END, "1m", budget=20000, action="reject")
+
+
+def test_plan_range_step_rejects_when_two_points_do_not_fit():
+    with pytest.raises(QueryBudgetExceeded):
+        plan_range_step(15000, START, END, "1m", budget=20000, action="step")
+
+
+def test_plan_range_step_zero_series():
+    step, decision = plan_range_step(0, START, END, "1m", budget=20000, action="reject")
+    assert step == "1m"
+    assert "0 series" in decision